@@ -1,14 +1,29 @@
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
+import numpy as np
 import pandas as pd
-from numpy import log
+import hashlib
+import heapq
 import os
+import tempfile
+import zipfile
+from functools import lru_cache
+from pathlib import Path
 from joblib import load
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import make_pipeline
 
 router = APIRouter()
 
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+CSV_DIR = BASE_DIR / "csv"
+BOOK_CSV = CSV_DIR / "book_data_processed.csv"
+COMMENTS_CSV = CSV_DIR / "comments_processed.csv"
+TAGGED_CSV = CSV_DIR / "book_tagged.csv"
+SVD_MODEL_PATH = BASE_DIR / "svd_model.joblib"
+CACHE_DIR = BASE_DIR / "cache"
+
 
 class Book(BaseModel):
     product_id: int
@@ -23,6 +38,291 @@ class TrendingBook(Book):
     trending_score: float
 
 
+@lru_cache(maxsize=1)
+def _load_books() -> pd.DataFrame:
+    """Load the processed book data once, dropping rows without a usable rating."""
+    if not BOOK_CSV.exists():
+        raise HTTPException(status_code=404, detail="Book data file not found")
+
+    df = pd.read_csv(BOOK_CSV)
+
+    df["avg_rating"] = pd.to_numeric(df["avg_rating"], errors="coerce")
+    df["n_review"] = pd.to_numeric(df["n_review"], errors="coerce")
+
+    return df.dropna(subset=["avg_rating", "n_review"])
+
+
+@lru_cache(maxsize=1)
+def _load_books_by_id() -> pd.DataFrame:
+    """Book data indexed by product id for hash-based detail lookups."""
+    return (
+        _load_books()
+        .drop_duplicates(subset=["product_id"])
+        .set_index("product_id", drop=False)
+        .rename_axis(None)
+    )
+
+
+def _book_details(product_ids) -> pd.DataFrame:
+    """Details of the given books in the order given, skipping unknown ids."""
+    book_by_id = _load_books_by_id()
+    positions = book_by_id.index.get_indexer(product_ids)
+    return book_by_id.iloc[positions[positions >= 0]]
+
+
+@lru_cache(maxsize=1)
+def _load_trending() -> pd.DataFrame:
+    """Book data with the trending score precomputed from its static columns."""
+    df = _load_books()
+    return df.assign(
+        trending_score=df["avg_rating"].to_numpy() * np.log1p(df["n_review"].to_numpy())
+    )
+
+
+@lru_cache(maxsize=1)
+def _load_comments() -> pd.DataFrame:
+    """Load the processed user comments (ratings) once."""
+    if not COMMENTS_CSV.exists():
+        raise HTTPException(status_code=404, detail="Comments data file not found")
+
+    return pd.read_csv(COMMENTS_CSV)
+
+
+@lru_cache(maxsize=1)
+def _all_products() -> np.ndarray:
+    """Sorted array of every product id that appears in the comments."""
+    return np.sort(_load_comments()["product_id"].unique())
+
+
+@lru_cache(maxsize=1)
+def _rated_by_user() -> dict[int, np.ndarray]:
+    """Map each customer id to the unique product ids they have rated."""
+    ratings = (
+        _load_comments()[["customer_id", "product_id"]]
+        .drop_duplicates()
+        .sort_values(["customer_id", "product_id"])
+    )
+    # One sorted pass and a split is far cheaper than groupby().unique() here.
+    users, starts = np.unique(ratings["customer_id"].to_numpy(), return_index=True)
+    products = np.split(ratings["product_id"].to_numpy(), starts[1:])
+    return dict(zip(users.tolist(), products))
+
+
+@lru_cache(maxsize=1)
+def _load_svd_model():
+    """Deserialize the trained Surprise SVD model once."""
+    if not SVD_MODEL_PATH.exists():
+        raise HTTPException(status_code=404, detail="Model file not found")
+
+    return load(SVD_MODEL_PATH)
+
+
+@lru_cache(maxsize=1)
+def _svd_item_index() -> pd.Index:
+    """Raw product ids of the SVD trainset, positioned by their inner id."""
+    trainset = _load_svd_model().trainset
+    return pd.Index([trainset.to_raw_iid(i) for i in trainset.all_items()])
+
+
+def _predict_ratings(model_svd, user_id: int, product_ids: np.ndarray) -> np.ndarray:
+    """
+    Estimate ``user_id``'s rating for each product in one vectorized pass.
+
+    Mirrors ``SVD.predict(user_id, product).est`` for unknown users and items,
+    but skips clipping to the rating scale so that estimates above the maximum
+    rating still rank against each other.
+    """
+    trainset = model_svd.trainset
+    inner_iids = _svd_item_index().get_indexer(product_ids)
+    known = inner_iids >= 0
+    inner_iids = inner_iids[known]
+
+    try:
+        inner_uid = trainset.to_inner_uid(user_id)
+    except ValueError:
+        inner_uid = None
+
+    est = np.full(len(product_ids), trainset.global_mean)
+    if model_svd.biased:
+        est[known] += model_svd.bi[inner_iids]
+        if inner_uid is not None:
+            est += model_svd.bu[inner_uid]
+
+    if inner_uid is not None:
+        factors = model_svd.qi[inner_iids] @ model_svd.pu[inner_uid]
+        if model_svd.biased:
+            est[known] += factors
+        else:
+            est[known] = factors
+
+    return est
+
+
+@lru_cache(maxsize=1)
+def _load_tagged() -> pd.DataFrame:
+    """Load the tagged book data used for content-based filtering once."""
+    if not TAGGED_CSV.exists():
+        raise HTTPException(status_code=404, detail="Book data file not found")
+
+    return pd.read_csv(TAGGED_CSV)
+
+
+@lru_cache(maxsize=1)
+def _tagged_rows() -> dict[int, int]:
+    """Map each product id to its first row in the tagged data."""
+    rows = {}
+    for row, product_id in enumerate(_load_tagged()["product_id"].tolist()):
+        rows.setdefault(product_id, row)
+    return rows
+
+
+def _tfidf_cache_path(tfidf, tags: pd.Series) -> Path:
+    """Cache file for the TF-IDF matrix, keyed by vectorizer settings and tags."""
+    key = hashlib.sha256(repr(sorted(tfidf.get_params().items())).encode())
+    key.update(pd.util.hash_pandas_object(tags, index=False).to_numpy().tobytes())
+    return CACHE_DIR / f"tfidf_mat_{key.hexdigest()[:16]}.npz"
+
+
+@lru_cache(maxsize=1)
+def _load_tfidf_matrix():
+    """
+    Fit TF-IDF on the book tags once and return the sparse document matrix.
+
+    Tags are hashed into a fixed feature space rather than building a
+    vocabulary, which keeps fitting cheap as the catalogue grows. Rows are
+    L2-normalised by the transformer, so the dot product of two rows is their
+    cosine similarity.
+
+    The fitted matrix is saved under ``CACHE_DIR`` with a name derived from
+    the vectorizer settings and the tag contents, and reused on later starts
+    only while both are unchanged.
+    """
+    tags = _load_tagged()["tags"].fillna("")
+    tfidf = make_pipeline(
+        HashingVectorizer(
+            n_features=2**20, alternate_sign=False, norm=None, dtype=np.float32
+        ),
+        TfidfTransformer(),
+    )
+    matrix_path = _tfidf_cache_path(tfidf, tags)
+
+    if matrix_path.exists():
+        try:
+            tfidf_matrix = sparse.load_npz(matrix_path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # A damaged cache file is refitted and overwritten below.
+            tfidf_matrix = None
+        if tfidf_matrix is not None and tfidf_matrix.shape[0] == len(tags):
+            return tfidf_matrix
+
+    tfidf_matrix = tfidf.fit_transform(tags)
+
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        # Write to a temp file and rename it into place, so a crash or a
+        # concurrent worker never leaves a partial file at the final path.
+        fd, tmp_name = tempfile.mkstemp(dir=CACHE_DIR, suffix=".npz")
+        os.close(fd)
+        try:
+            sparse.save_npz(tmp_name, tfidf_matrix, compressed=False)
+            os.chmod(tmp_name, 0o644)
+            os.replace(tmp_name, matrix_path)
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+        for stale_path in CACHE_DIR.glob("tfidf_mat_*.npz"):
+            if stale_path != matrix_path:
+                stale_path.unlink(missing_ok=True)
+    except OSError:
+        # The cache is only a start-up optimisation; serve the fitted matrix.
+        pass
+
+    return tfidf_matrix
+
+
+def warm_caches() -> None:
+    """
+    Populate the data and model caches before the first request is served.
+
+    Endpoints run in FastAPI's thread pool, so without this concurrent first
+    requests would each parse the CSVs, load the model and fit TF-IDF.
+    """
+    for loader in (
+        _load_trending,
+        _load_books_by_id,
+        _all_products,
+        _rated_by_user,
+        _svd_item_index,
+        _tagged_rows,
+        _load_tfidf_matrix,
+    ):
+        try:
+            loader()
+        except HTTPException:
+            # Missing files are reported by the endpoints that need them.
+            pass
+
+
+def _min_max_normalize(values: np.ndarray) -> np.ndarray:
+    """Scale values to [0, 1]; empty or constant input maps to zeros."""
+    if values.size == 0 or values.max() == values.min():
+        return np.zeros_like(values, dtype=float)
+
+    return (values - values.min()) / (values.max() - values.min())
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the ``k`` highest scores, best first (ties by index)."""
+    k = min(k, scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    top = np.argpartition(-scores, k - 1)[:k]
+    # argpartition picks arbitrarily among scores tied at the cut-off, so take
+    # every candidate reaching it and keep the lowest indices.
+    candidates = np.flatnonzero(scores >= scores[top].min())
+    return candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+
+def _compute_trending(top: int) -> pd.DataFrame:
+    """Return the ``top`` books by trending score, best first."""
+    df = _load_trending()
+
+    if df.empty:
+        raise HTTPException(status_code=400, detail="No valid book data found")
+
+    return df.nlargest(top, "trending_score")
+
+
+def _compute_cf(user_id: int, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the ids and predicted ratings of the ``n`` best unrated products."""
+    model_svd = _load_svd_model()
+
+    rated_products = _rated_by_user().get(user_id, np.empty(0, dtype=np.int64))
+    unrated_products = np.setdiff1d(_all_products(), rated_products, assume_unique=True)
+
+    scores = _predict_ratings(model_svd, user_id, unrated_products)
+    top = _top_k(scores, n)
+
+    return unrated_products[top], scores[top]
+
+
+def _compute_cbf(product_id: int, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the tagged-data rows and similarities of the ``n`` closest books."""
+    book_index = _tagged_rows().get(product_id)
+
+    if book_index is None:
+        raise HTTPException(status_code=404, detail="Book ID not found in dataset")
+
+    tfidf_matrix = _load_tfidf_matrix()
+
+    content_sim = (tfidf_matrix @ tfidf_matrix[book_index].T).toarray().ravel()
+    content_sim[book_index] = -np.inf
+
+    recommended_indices = _top_k(content_sim, min(n, content_sim.size - 1))
+
+    return recommended_indices, content_sim[recommended_indices]
+
+
 @router.get("/trending-books", response_model=list[TrendingBook])
 def get_trending_books(
     top: int = Query(10, description="Number of top trending books to return"),
@@ -34,24 +334,7 @@ def get_trending_books(
     :return: List of top trending books
     """
     try:
-        # Load book data from CSV
-        csv_path = os.path.join(os.getcwd(), "csv", "book_data_processed.csv")
-        if not os.path.exists(csv_path):
-            raise HTTPException(status_code=404, detail="Book data file not found")
-
-        df = pd.read_csv(csv_path)
-
-        df["avg_rating"] = pd.to_numeric(df["avg_rating"], errors="coerce")
-        df["n_review"] = pd.to_numeric(df["n_review"], errors="coerce")
-
-        df = df.dropna(subset=["avg_rating", "n_review"])
-
-        if df.empty:
-            raise HTTPException(status_code=400, detail="No valid book data found")
-
-        df["trending_score"] = df["avg_rating"] * log(1 + df["n_review"])
-
-        trending_books = df.sort_values(by="trending_score", ascending=False).head(top)
+        trending_books = _compute_trending(top)
 
         return [
             TrendingBook(**book) for book in trending_books.to_dict(orient="records")
@@ -76,20 +359,7 @@ def get_cf_recommendations(
     :return: List of recommended books
     """
     try:
-        model_path = os.path.join(os.getcwd(), "svd_model.joblib")
-        if not os.path.exists(model_path):
-            raise HTTPException(status_code=404, detail="Model file not found")
-        model_svd = load(model_path)
-
-        data_path = os.path.join(os.getcwd(), "csv", "comments_processed.csv")
-        if not os.path.exists(data_path):
-            raise HTTPException(status_code=404, detail="Comments data file not found")
-        cmt_cf = pd.read_csv(data_path)
-
-        book_data_path = os.path.join(os.getcwd(), "csv", "book_data_processed.csv")
-        if not os.path.exists(book_data_path):
-            raise HTTPException(status_code=404, detail="Book data file not found")
-        book_df = pd.read_csv(book_data_path)
+        book_by_id = _load_books_by_id()
 
         required_columns = {
             "product_id",
@@ -99,39 +369,19 @@ def get_cf_recommendations(
             "n_review",
             "cover_link",
         }
-        if not required_columns.issubset(set(book_df.columns)):
+        if not required_columns.issubset(set(book_by_id.columns)):
             raise HTTPException(
                 status_code=400, detail="Book data is missing required columns"
             )
 
-        # Get recommendations
-        all_products = cmt_cf["product_id"].unique()
-        rated_products = cmt_cf[cmt_cf["customer_id"] == user_id]["product_id"].unique()
-        unrated_products = [
-            product for product in all_products if product not in rated_products
-        ]
-
-        predictions = [
-            (product, model_svd.predict(user_id, product).est)
-            for product in unrated_products
-        ]
-        predictions.sort(key=lambda x: x[1], reverse=True)
-
-        recommended_books_id = [pred[0] for pred in predictions][:n]
-        recommend_books_details = book_df[
-            book_df["product_id"].isin(recommended_books_id)
-        ].drop_duplicates(subset=["product_id"])
+        recommended_books_id, _ = _compute_cf(user_id, n)
+        recommend_books_details = _book_details(recommended_books_id)
 
         return [
-            Book(
-                product_id=row["product_id"],
-                title=row["title"],
-                authors=row["authors"],
-                avg_rating=row["avg_rating"],
-                n_review=row["n_review"],
-                cover_link=row["cover_link"],
+            Book(**book)
+            for book in recommend_books_details[list(Book.model_fields)].to_dict(
+                orient="records"
             )
-            for _, row in recommend_books_details.iterrows()
         ]
 
     except HTTPException as e:
@@ -155,27 +405,10 @@ def get_cfb_recommendations(
     :return: List of recommended books with similarity scores
     """
     try:
-        book_tagged_data_path = os.path.join(os.getcwd(), "csv", "book_tagged.csv")
-        if not os.path.exists(book_tagged_data_path):
-            raise HTTPException(status_code=404, detail="Book data file not found")
-
-        book_data = pd.read_csv(book_tagged_data_path)
-
-        if product_id not in book_data["product_id"].values:
-            raise HTTPException(status_code=404, detail="Book ID not found in dataset")
-
-        tfidf = TfidfVectorizer()
-        tfidf_matrix = tfidf.fit_transform(book_data["tags"].fillna(""))
-        content_cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-
-        book_index = book_data[book_data["product_id"] == product_id].index[0]
+        recommended_indices, similarity_scores = _compute_cbf(product_id, n)
 
-        sim_scores = list(enumerate(content_cosine_sim[book_index]))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-
-        recommended_indices = [i[0] for i in sim_scores[1 : n + 1]]
-        recommended_books = book_data.iloc[recommended_indices].copy()
-        recommended_books["similarity_score"] = [i[1] for i in sim_scores[1 : n + 1]]
+        recommended_books = _load_tagged().iloc[recommended_indices].copy()
+        recommended_books["similarity_score"] = similarity_scores
 
         recommended_books = recommended_books[
             [
@@ -209,36 +442,24 @@ def get_hybrid_recommendations(
     cbf_weight: float = Query(0.5, description="Weight for Content-Based Filtering"),
 ):
     try:
-        book_data_path = os.path.join(os.getcwd(), "csv", "book_data_processed.csv")
-
-        book_data = pd.read_csv(book_data_path)
-
-        cf_rec = get_cf_recommendations(user_id, n)
-        cf_rec = pd.DataFrame([book.model_dump() for book in cf_rec])
-        cf_rec["normalized_rating"] = (
-            cf_rec["avg_rating"] - cf_rec["avg_rating"].min()
-        ) / (cf_rec["avg_rating"].max() - cf_rec["avg_rating"].min())
-        cf_rec = cf_rec[["product_id", "normalized_rating"]]
+        cf_ids, cf_raw = _compute_cf(user_id, n)
+        cf_scores = _min_max_normalize(cf_raw)
+        cf_dict = dict(zip(cf_ids.tolist(), cf_scores.tolist()))
 
-        cbf_rec = get_cfb_recommendations(product_id, n)
-        cbf_rec = pd.DataFrame(cbf_rec)
-        cbf_rec = cbf_rec[["product_id", "similarity_score"]]
+        cbf_rows, cbf_scores = _compute_cbf(product_id, n)
+        cbf_ids = _load_tagged()["product_id"].to_numpy()[cbf_rows]
+        cbf_dict = dict(zip(cbf_ids.tolist(), cbf_scores.tolist()))
 
-        combined_rec = pd.merge(cf_rec, cbf_rec, on="product_id", how="outer").fillna(0)
-
-        combined_rec["hybrid_score"] = (
-            cf_weight * combined_rec["normalized_rating"]
-            + cbf_weight * combined_rec["similarity_score"]
+        hybrid_scores = {
+            pid: cf_weight * cf_dict.get(pid, 0.0) + cbf_weight * cbf_dict.get(pid, 0.0)
+            for pid in sorted(cf_dict.keys() | cbf_dict.keys())
+        }
+        top_scores = dict(
+            heapq.nlargest(n, hybrid_scores.items(), key=lambda item: item[1])
         )
-        combined_rec = combined_rec.sort_values(
-            by="hybrid_score", ascending=False
-        ).head(n)
 
-        recommended_books = book_data[
-            book_data["product_id"].isin(combined_rec["product_id"])
-        ]
-        recommended_books["hybrid_score"] = recommended_books["product_id"].map(
-            combined_rec.set_index("product_id")["hybrid_score"]
+        recommended_books = _book_details(list(top_scores)).assign(
+            hybrid_score=lambda df: df["product_id"].map(top_scores)
         )
 
         return recommended_books.to_dict(orient="records")
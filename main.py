@@ -1,7 +1,16 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from api.routes.books import router
+from api.routes.books import router, warm_caches
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_caches()
+    yield
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(router, prefix="/api")
 
@@ -0,0 +1,147 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from api.routes import books
+from api.routes.books import _top_k
+
+
+class TopKTest(unittest.TestCase):
+    def test_orders_by_score(self):
+        scores = np.array([0.2, 0.9, 0.5, 0.7])
+        self.assertEqual(_top_k(scores, 3).tolist(), [1, 3, 2])
+
+    def test_ties_at_cut_off_keep_lowest_indices(self):
+        scores = np.array([1.0] + [0.5] * 50)
+        self.assertEqual(_top_k(scores, 5).tolist(), [0, 1, 2, 3, 4])
+
+    def test_matches_stable_sort(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            scores = rng.integers(0, 4, size=rng.integers(1, 40)).astype(float)
+            k = int(rng.integers(1, 45))
+            expected = np.argsort(-scores, kind="stable")[:k]
+            self.assertEqual(_top_k(scores, k).tolist(), expected.tolist())
+
+    def test_non_positive_k_is_empty(self):
+        scores = np.array([0.3, 0.1])
+        self.assertEqual(_top_k(scores, 0).size, 0)
+        self.assertEqual(_top_k(scores, -1).size, 0)
+
+
+class PredictRatingsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model = books._load_svd_model()
+        trainset = cls.model.trainset
+        cls.known_user = trainset.to_raw_uid(0)
+        cls.products = np.array(
+            [trainset.to_raw_iid(i) for i in range(min(50, trainset.n_items))]
+        )
+
+    def assert_matches_predict(self, user_id, product_ids):
+        expected = [
+            self.model.predict(user_id, product_id, clip=False).est
+            for product_id in product_ids.tolist()
+        ]
+        np.testing.assert_allclose(
+            books._predict_ratings(self.model, user_id, product_ids),
+            expected,
+            rtol=0,
+            atol=1e-12,
+        )
+
+    def test_known_user(self):
+        self.assert_matches_predict(self.known_user, self.products)
+
+    def test_unknown_user(self):
+        self.assert_matches_predict(-1, self.products)
+
+    def test_unknown_item(self):
+        product_ids = np.append(self.products[:5], -1)
+        self.assert_matches_predict(self.known_user, product_ids)
+        self.assert_matches_predict(-1, product_ids)
+
+
+class TfidfCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_dir = Path(tmp_dir.name)
+        patcher = mock.patch.object(books, "CACHE_DIR", self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        books._load_tfidf_matrix.cache_clear()
+        self.addCleanup(books._load_tfidf_matrix.cache_clear)
+
+    def _cached_files(self):
+        return list(self.cache_dir.glob("tfidf_mat_*.npz"))
+
+    def test_damaged_cache_is_refitted(self):
+        books._load_tfidf_matrix()
+        (matrix_path,) = self._cached_files()
+        matrix_path.write_bytes(b"not a zip file")
+        books._load_tfidf_matrix.cache_clear()
+
+        tfidf_matrix = books._load_tfidf_matrix()
+
+        self.assertEqual(tfidf_matrix.shape[0], len(books._load_tagged()))
+        self.assertEqual(sparse.load_npz(matrix_path).shape, tfidf_matrix.shape)
+        self.assertEqual(list(self.cache_dir.iterdir()), [matrix_path])
+
+    def test_changed_tags_miss_the_cache(self):
+        books._load_tfidf_matrix()
+        (old_path,) = self._cached_files()
+        tagged = books._load_tagged()
+        changed = tagged.assign(tags=tagged["tags"].fillna("") + " extra")
+        books._load_tfidf_matrix.cache_clear()
+
+        with mock.patch.object(books, "_load_tagged", return_value=changed):
+            books._load_tfidf_matrix()
+
+        (new_path,) = self._cached_files()
+        self.assertNotEqual(new_path, old_path)
+
+    def test_changed_settings_change_the_cache_key(self):
+        tags = books._load_tagged()["tags"].fillna("")
+        path = books._tfidf_cache_path(
+            HashingVectorizer(n_features=2**20, alternate_sign=False), tags
+        )
+        other = books._tfidf_cache_path(
+            HashingVectorizer(n_features=2**18, alternate_sign=False), tags
+        )
+        self.assertNotEqual(path, other)
+
+
+class HybridRecommendationsTest(unittest.TestCase):
+    def _ranking(self, cf_weight):
+        recommendations = books.get_hybrid_recommendations(
+            user_id=20600429,
+            product_id=3954355,
+            n=5,
+            cf_weight=cf_weight,
+            cbf_weight=1 - cf_weight,
+        )
+        return [book["product_id"] for book in recommendations]
+
+    def test_cf_weight_changes_ranking(self):
+        cf_ids, _ = books._compute_cf(20600429, 5)
+        cbf_rows, _ = books._compute_cbf(3954355, 5)
+        cbf_ids = books._load_tagged()["product_id"].to_numpy()[cbf_rows]
+
+        cf_heavy = self._ranking(0.9)
+        cbf_heavy = self._ranking(0.1)
+
+        self.assertNotEqual(cf_heavy, cbf_heavy)
+        self.assertEqual(cf_heavy[0], cf_ids[0])
+        self.assertIn(cbf_heavy[0], cbf_ids.tolist())
+        self.assertNotIn(cf_ids[0], cbf_heavy[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()